@@ -1,17 +1,24 @@
 import os
 from dotenv import load_dotenv
 from pathlib import Path
+from typing import Optional
 
 # Get the backend directory path
 BACKEND_DIR = Path(__file__).parent
 ENV_FILE = BACKEND_DIR.parent / ".env"  # .env in project root
 
+# Marker so the .env file is parsed only once per process tree
+# (reload workers and forks inherit the already-loaded environment)
+_ENV_LOADED_FLAG = "_YTQA_ENV_LOADED"
+
 # Load environment variables from .env file
-if ENV_FILE.exists():
-    load_dotenv(ENV_FILE)
-else:
-    # Fallback: try loading from backend directory
-    load_dotenv(BACKEND_DIR / ".env")
+if not os.environ.get(_ENV_LOADED_FLAG):
+    if ENV_FILE.exists():
+        load_dotenv(ENV_FILE, override=False)
+    else:
+        # Fallback: try loading from backend directory
+        load_dotenv(BACKEND_DIR / ".env", override=False)
+    os.environ[_ENV_LOADED_FLAG] = "1"
 
 class Settings:
     """Application settings loaded from environment variables"""
@@ -27,37 +34,48 @@ class Settings:
     API_TITLE: str = "YouTube Q&A API"
     API_VERSION: str = "1.0.0"
     
+    # Conversation Memory Configuration
+    # When set, conversation history is stored in Redis and shared by all workers
+    REDIS_URL: str = os.getenv("REDIS_URL", "")
+    
+    # Server Configuration
+    # Without REDIS_URL conversation memory is per-process, so keep a single
+    # worker unless Redis is configured
+    WORKERS: int = int(os.getenv("WEB_CONCURRENCY", "1"))
+    
     YOUTUBE_API_KEY: str = os.getenv("YOUTUBE_API_KEY", "")
     
+    def __init__(self):
+        # Settings don't change after startup, so compute derived values once
+        self._missing: tuple[str, ...] = tuple(
+            name for name, value in (
+                ("AZURE_OPENAI_API_KEY", self.AZURE_OPENAI_API_KEY),
+                ("AZURE_OPENAI_ENDPOINT", self.AZURE_OPENAI_ENDPOINT),
+                ("AZURE_OPENAI_DEPLOYMENT_NAME", self.AZURE_OPENAI_DEPLOYMENT_NAME)
+            )
+            if not value
+        )
+        self._valid: bool = not self._missing
+        self._azure_url: Optional[str] = None
+        if self.AZURE_OPENAI_ENDPOINT and self.AZURE_OPENAI_DEPLOYMENT_NAME:
+            # Ensure endpoint doesn't end with /
+            endpoint = self.AZURE_OPENAI_ENDPOINT.rstrip('/')
+            self._azure_url = f"{endpoint}/openai/deployments/{self.AZURE_OPENAI_DEPLOYMENT_NAME}/chat/completions"
+    
     @property
     def azure_openai_url(self) -> str:
         """Construct the full Azure OpenAI API URL"""
-        if not self.AZURE_OPENAI_ENDPOINT or not self.AZURE_OPENAI_DEPLOYMENT_NAME:
+        if self._azure_url is None:
             raise ValueError("Azure OpenAI endpoint and deployment name must be configured")
-        
-        # Ensure endpoint doesn't end with /
-        endpoint = self.AZURE_OPENAI_ENDPOINT.rstrip('/')
-        return f"{endpoint}/openai/deployments/{self.AZURE_OPENAI_DEPLOYMENT_NAME}/chat/completions"
+        return self._azure_url
     
     def validate(self) -> bool:
         """Validate that all required settings are present"""
-        required = [
-            self.AZURE_OPENAI_API_KEY,
-            self.AZURE_OPENAI_ENDPOINT,
-            self.AZURE_OPENAI_DEPLOYMENT_NAME
-        ]
-        return all(required)
+        return self._valid
     
     def get_missing_settings(self) -> list[str]:
         """Get list of missing required settings"""
-        missing = []
-        if not self.AZURE_OPENAI_API_KEY:
-            missing.append("AZURE_OPENAI_API_KEY")
-        if not self.AZURE_OPENAI_ENDPOINT:
-            missing.append("AZURE_OPENAI_ENDPOINT")
-        if not self.AZURE_OPENAI_DEPLOYMENT_NAME:
-            missing.append("AZURE_OPENAI_DEPLOYMENT_NAME")
-        return missing
+        return list(self._missing)
 
 # Global settings instance
 settings = Settings()
\ No newline at end of file
@@ -1,13 +1,16 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
+from contextlib import asynccontextmanager
 from config import settings
 from models.schemas import QARequest, AutoQARequest, QAResponse, HealthResponse
-from services.azure_openai import get_azure_service
-from services.youtube_transcript import YouTubeTranscriptService
+from services.azure_openai import get_azure_service, close_azure_service
+from services.youtube_transcript import YouTubeTranscriptService, close_client as close_youtube_client
 from services.conversation_memory import conversation_memory
 from typing import Optional
 from pathlib import Path
+from datetime import datetime
+import orjson
 import logging
 
 # Configure logging
@@ -17,71 +20,84 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize FastAPI app
-app = FastAPI(
-    title=settings.API_TITLE,
-    version=settings.API_VERSION,
-    description="Backend API for YouTube Q&A Chrome Extension",
-    docs_url="/docs",  # Swagger UI at /docs
-    redoc_url="/redoc"  # ReDoc at /redoc
-)
-
-# Configure CORS - Allow Chrome extension origin
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "chrome-extension://*",  # Allow all Chrome extensions
-        "http://localhost:*",    # For local testing
-        "http://127.0.0.1:*",    # For local testing
-        "https://www.youtube.com"  # Allow YouTube origin
-    ],
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "OPTIONS"],
-    allow_headers=["*"],
-    expose_headers=["*"]
-)
-
-@app.on_event("startup")
-async def startup_event():
-    """Initialize services on startup"""
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize services on startup and release them on shutdown"""
     logger.info("Starting YouTube Q&A API...")
+    app.state.azure = None
+    app.state.config_error = None
     if settings.validate():
         logger.info("Azure OpenAI configuration validated successfully")
         try:
-            # Test service initialization
-            get_azure_service()
+            app.state.azure = get_azure_service()
             logger.info("Azure OpenAI service initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize Azure OpenAI service: {e}")
     else:
         missing = settings.get_missing_settings()
         logger.warning(f"Azure OpenAI not fully configured. Missing: {', '.join(missing)}")
-
-@app.get("/", response_model=HealthResponse)
-async def root():
-    """Root endpoint - health check"""
+        # Only the detail is cached; a shared exception object would keep
+        # accumulating traceback frames each time it is re-raised
+        app.state.config_error = f"Azure OpenAI is not configured. Missing: {', '.join(missing)}"
+    
+    # Configuration is fixed after startup, so health responses are built once
     is_configured = settings.validate()
     missing = settings.get_missing_settings() if not is_configured else None
-    
-    return HealthResponse(
+    app.state.root_response = HealthResponse(
         status="healthy",
         message="YouTube Q&A API is running",
         azure_configured=is_configured,
         missing_settings=missing
     )
-
-@app.get("/health", response_model=HealthResponse)
-async def health_check():
-    """Health check endpoint with detailed status"""
-    is_configured = settings.validate()
-    missing = settings.get_missing_settings() if not is_configured else None
-    
-    return HealthResponse(
+    app.state.health_response = HealthResponse(
         status="healthy",
         message="API is operational" if is_configured else "API is running but Azure OpenAI is not configured",
         azure_configured=is_configured,
         missing_settings=missing
     )
+    
+    yield
+    
+    # Close the shared connection pools
+    await close_azure_service()
+    app.state.azure = None
+    await close_youtube_client()
+    await conversation_memory.aclose()
+    logger.info("YouTube Q&A API shut down")
+
+# Initialize FastAPI app
+app = FastAPI(
+    title=settings.API_TITLE,
+    version=settings.API_VERSION,
+    description="Backend API for YouTube Q&A Chrome Extension",
+    docs_url="/docs",  # Swagger UI at /docs
+    redoc_url="/redoc",  # ReDoc at /redoc
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
+)
+
+# Configure CORS - Allow Chrome extension origin
+app.add_middleware(
+    CORSMiddleware,
+    # Wildcards aren't supported in allow_origins, so match with a single regex:
+    # any Chrome extension, localhost/127.0.0.1 on any port (local testing),
+    # and the YouTube origin
+    allow_origin_regex=r"^(chrome-extension://[a-p]{32}|https?://(localhost|127\.0\.0\.1)(:\d+)?|https://www\.youtube\.com)$",
+    allow_credentials=True,
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["*"],
+    expose_headers=["*"]
+)
+
+@app.get("/", response_model=HealthResponse)
+async def root(request: Request):
+    """Root endpoint - health check"""
+    return request.app.state.root_response
+
+@app.get("/health", response_model=HealthResponse)
+async def health_check(request: Request):
+    """Health check endpoint with detailed status"""
+    return request.app.state.health_response
 
 @app.get("/privacy-policy")
 async def privacy_policy():
@@ -107,11 +123,14 @@ async def get_conversation_history(video_id: str, session_id: Optional[str] = No
     - List of Q&A exchanges in the conversation
     """
     try:
-        history = conversation_memory.get_history(video_id, session_id)
+        history = await conversation_memory.get_history(video_id, session_id)
         return {
             "video_id": video_id,
             "session_id": session_id or "default",
-            "history": history,
+            "history": [
+                {**exchange._asdict(), "timestamp": datetime.fromtimestamp(exchange.timestamp).isoformat()}
+                for exchange in history
+            ],
             "count": len(history)
         }
     except Exception as e:
@@ -134,7 +153,7 @@ async def clear_conversation_history(video_id: str, session_id: Optional[str] =
     - Success message
     """
     try:
-        conversation_memory.clear_history(video_id, session_id)
+        await conversation_memory.clear_history(video_id, session_id)
         return {
             "success": True,
             "message": f"Conversation history cleared for video: {video_id}, session: {session_id or 'default'}"
@@ -147,7 +166,7 @@ async def clear_conversation_history(video_id: str, session_id: Optional[str] =
         )
 
 @app.post("/api/qa/auto", response_model=QAResponse)
-async def ask_question_auto(request: AutoQARequest):
+async def ask_question_auto(request: AutoQARequest, http_request: Request):
     """
     Automatic Q&A endpoint - Fetches transcript automatically from YouTube with conversation memory
     
@@ -174,12 +193,11 @@ async def ask_question_auto(request: AutoQARequest):
     - conversation_length: Number of Q&A exchanges in this conversation
     """
     try:
-        # Validate Azure OpenAI is configured
-        if not settings.validate():
-            missing = settings.get_missing_settings()
+        # Validate Azure OpenAI is configured (checked once at startup)
+        if http_request.app.state.config_error:
             raise HTTPException(
                 status_code=503,
-                detail=f"Azure OpenAI is not configured. Missing: {', '.join(missing)}"
+                detail=http_request.app.state.config_error
             )
         
         # Validate input
@@ -198,7 +216,7 @@ async def ask_question_auto(request: AutoQARequest):
         logger.info(f"Processing automatic Q&A request for video: {request.video_id}")
         
         # Step 1: Fetch transcript from YouTube
-        transcript_success, transcript, transcript_error = await YouTubeTranscriptService.get_transcript(
+        transcript_success, transcript, transcript_error = await YouTubeTranscriptService.get_cached_transcript(
             request.video_id
         )
         
@@ -214,23 +232,20 @@ async def ask_question_auto(request: AutoQARequest):
         
         # Step 2: Handle conversation memory
         if request.clear_history:
-            conversation_memory.clear_history(request.video_id, request.session_id)
+            await conversation_memory.clear_history(request.video_id, request.session_id)
             logger.info(f"Cleared conversation history for video: {request.video_id}, session: {request.session_id}")
         
         # Get conversation history
-        history = conversation_memory.get_history(request.video_id, request.session_id)
-        formatted_history = conversation_memory.format_history_for_prompt(history) if history else None
+        formatted_history = await conversation_memory.get_formatted_history(request.video_id, request.session_id) or None
         
-        logger.info(f"Conversation history: {len(history)} previous exchanges")
+        logger.info(f"Conversation history: {'included' if formatted_history else 'none'}")
         
         # Step 3: Get Azure OpenAI service
-        try:
-            azure_service = get_azure_service()
-        except Exception as e:
-            logger.error(f"Failed to get Azure service: {e}")
+        azure_service = http_request.app.state.azure
+        if azure_service is None:
             raise HTTPException(
                 status_code=503,
-                detail=f"Azure OpenAI service unavailable: {str(e)}"
+                detail="Azure OpenAI service unavailable: initialization failed at startup"
             )
         
         # Step 4: Call Azure OpenAI service with conversation history
@@ -242,16 +257,13 @@ async def ask_question_auto(request: AutoQARequest):
         
         if success:
             # Store the exchange in conversation memory
-            conversation_memory.add_exchange(
+            conversation_length = await conversation_memory.add_exchange(
                 video_id=request.video_id,
                 question=request.question,
                 answer=answer,
                 session_id=request.session_id
             )
             
-            # Get updated conversation length
-            updated_history = conversation_memory.get_history(request.video_id, request.session_id)
-            
             logger.info(f"Successfully generated answer for video: {request.video_id}")
             return QAResponse(
                 success=True,
@@ -260,7 +272,7 @@ async def ask_question_auto(request: AutoQARequest):
                 video_id=request.video_id,
                 transcript_fetched=True,
                 session_id=request.session_id,
-                conversation_length=len(updated_history)
+                conversation_length=conversation_length
             )
         else:
             logger.error(f"Azure OpenAI error for video {request.video_id}: {error}")
@@ -278,8 +290,130 @@ async def ask_question_auto(request: AutoQARequest):
             detail=f"Internal server error: {str(e)}"
         )
 
+@app.post("/api/qa/auto/stream")
+async def ask_question_auto_stream(request: AutoQARequest, http_request: Request):
+    """
+    Streaming variant of /api/qa/auto - Returns the answer as server-sent events
+    
+    The transcript is fetched and validated before the stream starts, so those
+    failures still return regular HTTP errors. The answer is then streamed as
+    it is generated and stored in conversation memory once complete.
+    
+    Request Body:
+    - Same as /api/qa/auto
+    
+    Returns (text/event-stream, one JSON object per "data:" event):
+    - {"delta": "..."}: Next chunk of the answer
+    - {"error": "..."}: Generation failed; the stream ends
+    - {"done": true, "video_id", "session_id", "conversation_length"}: Final event
+      (conversation_length is null if the exchange could not be stored)
+    """
+    try:
+        # Validate Azure OpenAI is configured (checked once at startup)
+        if http_request.app.state.config_error:
+            raise HTTPException(
+                status_code=503,
+                detail=http_request.app.state.config_error
+            )
+        
+        # Validate input
+        if not request.video_id or not request.video_id.strip():
+            raise HTTPException(
+                status_code=400,
+                detail="Video ID cannot be empty"
+            )
+        
+        if not request.question or not request.question.strip():
+            raise HTTPException(
+                status_code=400,
+                detail="Question cannot be empty"
+            )
+        
+        logger.info(f"Processing streaming Q&A request for video: {request.video_id}")
+        
+        # Fetch transcript from YouTube
+        transcript_success, transcript, transcript_error = await YouTubeTranscriptService.get_cached_transcript(
+            request.video_id
+        )
+        
+        if not transcript_success:
+            logger.error(f"Failed to fetch transcript: {transcript_error}")
+            raise HTTPException(
+                status_code=404,
+                detail=f"Could not fetch transcript: {transcript_error}"
+            )
+        
+        logger.info(f"Transcript fetched successfully ({len(transcript)} characters)")
+        
+        # Handle conversation memory
+        if request.clear_history:
+            await conversation_memory.clear_history(request.video_id, request.session_id)
+            logger.info(f"Cleared conversation history for video: {request.video_id}, session: {request.session_id}")
+        
+        formatted_history = await conversation_memory.get_formatted_history(request.video_id, request.session_id) or None
+        
+        logger.info(f"Conversation history: {'included' if formatted_history else 'none'}")
+        
+        azure_service = http_request.app.state.azure
+        if azure_service is None:
+            raise HTTPException(
+                status_code=503,
+                detail="Azure OpenAI service unavailable: initialization failed at startup"
+            )
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected error in /api/qa/auto/stream: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Internal server error: {str(e)}"
+        )
+    
+    async def event_stream():
+        chunks = []
+        async for delta, error in azure_service.ask_question_stream(
+            transcript=transcript,
+            question=request.question,
+            conversation_history=formatted_history
+        ):
+            if error:
+                logger.error(f"Azure OpenAI error for video {request.video_id}: {error}")
+                yield b"data: " + orjson.dumps({"error": error}) + b"\n\n"
+                return
+            chunks.append(delta)
+            yield b"data: " + orjson.dumps({"delta": delta}) + b"\n\n"
+        
+        answer = "".join(chunks)
+        if not answer:
+            yield b"data: " + orjson.dumps({"error": "No response content from Azure OpenAI"}) + b"\n\n"
+            return
+        
+        # Persist the exchange only once the full answer is known. The answer has
+        # already been sent, so a storage failure still ends the stream with "done"
+        try:
+            conversation_length = await conversation_memory.add_exchange(
+                video_id=request.video_id,
+                question=request.question,
+                answer=answer,
+                session_id=request.session_id
+            )
+        except Exception as e:
+            logger.error(f"Failed to store exchange for video {request.video_id}: {str(e)}", exc_info=True)
+            conversation_length = None
+        
+        logger.info(f"Successfully streamed answer for video: {request.video_id}")
+        yield b"data: " + orjson.dumps({
+            "done": True,
+            "video_id": request.video_id,
+            "session_id": request.session_id,
+            "conversation_length": conversation_length
+        }) + b"\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.post("/api/qa", response_model=QAResponse)
-async def ask_question(request: QARequest):
+async def ask_question(request: QARequest, http_request: Request):
     """
     Manual Q&A endpoint - Requires transcript to be provided
     
@@ -303,12 +437,11 @@ async def ask_question(request: QARequest):
     - conversation_length: Number of Q&A exchanges in this conversation
     """
     try:
-        # Validate Azure OpenAI is configured
-        if not settings.validate():
-            missing = settings.get_missing_settings()
+        # Validate Azure OpenAI is configured (checked once at startup)
+        if http_request.app.state.config_error:
             raise HTTPException(
                 status_code=503,
-                detail=f"Azure OpenAI is not configured. Missing: {', '.join(missing)}"
+                detail=http_request.app.state.config_error
             )
         
         # Validate input
@@ -330,23 +463,20 @@ async def ask_question(request: QARequest):
         
         # Handle conversation memory
         if request.clear_history:
-            conversation_memory.clear_history(request.video_id, request.session_id)
+            await conversation_memory.clear_history(request.video_id, request.session_id)
             logger.info(f"Cleared conversation history for video: {request.video_id}, session: {request.session_id}")
         
         # Get conversation history
-        history = conversation_memory.get_history(request.video_id, request.session_id)
-        formatted_history = conversation_memory.format_history_for_prompt(history) if history else None
+        formatted_history = await conversation_memory.get_formatted_history(request.video_id, request.session_id) or None
         
-        logger.info(f"Conversation history: {len(history)} previous exchanges")
+        logger.info(f"Conversation history: {'included' if formatted_history else 'none'}")
         
         # Get Azure OpenAI service
-        try:
-            azure_service = get_azure_service()
-        except Exception as e:
-            logger.error(f"Failed to get Azure service: {e}")
+        azure_service = http_request.app.state.azure
+        if azure_service is None:
             raise HTTPException(
                 status_code=503,
-                detail=f"Azure OpenAI service unavailable: {str(e)}"
+                detail="Azure OpenAI service unavailable: initialization failed at startup"
             )
         
         # Call Azure OpenAI service with conversation history
@@ -358,16 +488,13 @@ async def ask_question(request: QARequest):
         
         if success:
             # Store the exchange in conversation memory
-            conversation_memory.add_exchange(
+            conversation_length = await conversation_memory.add_exchange(
                 video_id=request.video_id,
                 question=request.question,
                 answer=answer,
                 session_id=request.session_id
             )
             
-            # Get updated conversation length
-            updated_history = conversation_memory.get_history(request.video_id, request.session_id)
-            
             logger.info(f"Successfully generated answer for video: {request.video_id}")
             return QAResponse(
                 success=True,
@@ -376,7 +503,7 @@ async def ask_question(request: QARequest):
                 video_id=request.video_id,
                 transcript_fetched=False,
                 session_id=request.session_id,
-                conversation_length=len(updated_history)
+                conversation_length=conversation_length
             )
         else:
             logger.error(f"Azure OpenAI error for video {request.video_id}: {error}")
@@ -400,6 +527,8 @@ if __name__ == "__main__":
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        workers=settings.WORKERS,
+        loop="uvloop",  # libuv-based event loop
+        http="httptools",  # C HTTP parser
         log_level="info"
     )
\ No newline at end of file
@@ -1,10 +1,51 @@
 import httpx
-from typing import Optional
+import orjson
+from typing import AsyncIterator, Optional
 from config import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+# System prompts are static, so build both variants once at import time
+_SYSTEM_PROMPT_INTRO = (
+    "You are an expert Q&A assistant for video content. "
+    "You analyze video content and provide helpful, accurate, and engaging answers. "
+    "Always be conversational, natural, and helpful. "
+    "IMPORTANT: Never mention 'transcript', 'transcription', 'captions', or any technical details about how you access the content. "
+    "Act as if you are directly watching and analyzing the video. "
+    "Use phrases like 'in this video', 'the speaker mentions', 'the video discusses', 'as shown in the video', etc. "
+)
+
+_SYSTEM_PROMPT_HISTORY = (
+    "You have access to previous questions and answers in this conversation. "
+    "Use this context to provide better answers, especially for follow-up questions. "
+    "If the current question refers to something from the previous conversation, "
+    "you can reference it naturally. "
+)
+
+_SYSTEM_PROMPT_GUIDELINES = (
+    "When answering questions:\n"
+    "- Base your answers on what is discussed in the video\n"
+    "- If specific details aren't mentioned, provide a helpful response based on what IS discussed\n"
+    "- Never say phrases like 'not provided', 'not mentioned', 'details are not provided', 'not in the transcript', or 'the transcript doesn't mention'\n"
+    "- Instead, offer related information from the video or explain what the video does cover on that topic\n"
+    "- Be conversational and helpful - focus on what the video DOES discuss rather than what it doesn't\n"
+    "- If asked about something completely unrelated to the video content, politely redirect to what the video is actually about\n"
+    "- Always speak as if you watched the video yourself - use natural language like 'In this video, the speaker explains...' or 'The video covers...'"
+)
+
+_SYSTEM_PROMPT = _SYSTEM_PROMPT_INTRO + _SYSTEM_PROMPT_GUIDELINES
+_SYSTEM_PROMPT_WITH_HISTORY = _SYSTEM_PROMPT_INTRO + _SYSTEM_PROMPT_HISTORY + _SYSTEM_PROMPT_GUIDELINES
+
+# Static generation parameters; "messages" is filled in per request
+_PAYLOAD_TEMPLATE = {
+    "temperature": 0.7,
+    "max_tokens": 1000,
+    "top_p": 0.95,
+    "frequency_penalty": 0,
+    "presence_penalty": 0
+}
+
 class AzureOpenAIService:
     """Service for interacting with Azure OpenAI API"""
     
@@ -19,8 +60,82 @@ class AzureOpenAIService:
         self.api_key = settings.AZURE_OPENAI_API_KEY
         self.api_url = settings.azure_openai_url
         self.api_version = settings.AZURE_OPENAI_API_VERSION
+        self._full_url = f"{self.api_url}?api-version={self.api_version}"
+        
+        # Long-lived client so requests reuse pooled keep-alive connections
+        # Extended timeout for long transcripts
+        self._client = httpx.AsyncClient(
+            timeout=120.0,
+            limits=httpx.Limits(
+                max_keepalive_connections=32,
+                max_connections=64,
+                keepalive_expiry=300
+            ),
+            headers={
+                "Content-Type": "application/json",
+                "Accept-Encoding": "gzip, br",
+                "api-key": self.api_key
+            },
+            # Multiplex concurrent requests over one connection
+            http2=True
+        )
         logger.info(f"Azure OpenAI service initialized with endpoint: {settings.AZURE_OPENAI_ENDPOINT}")
     
+    @staticmethod
+    def _build_payload(
+        transcript: str,
+        question: str,
+        conversation_history: Optional[str] = None
+    ) -> dict:
+        """Build the chat completions request payload"""
+        # Build the user content with optional conversation history
+        # Don't label it as "transcript" - make it feel like video content
+        # Built in a single join so the (large) transcript is copied only once
+        if conversation_history:
+            user_content = "".join((
+                "Video Content:\n\n", transcript, "\n\n",
+                conversation_history, "\n\n",
+                "Question: ", question
+            ))
+        else:
+            user_content = "".join((
+                "Video Content:\n\n", transcript, "\n\n",
+                "Question: ", question
+            ))
+        
+        # Construct the system and user messages for RAG
+        system_message = _SYSTEM_PROMPT_WITH_HISTORY if conversation_history else _SYSTEM_PROMPT
+        
+        # Prepare the request payload from the static template
+        return {
+            **_PAYLOAD_TEMPLATE,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_message
+                },
+                {
+                    "role": "user",
+                    "content": user_content
+                }
+            ]
+        }
+    
+    @staticmethod
+    def _format_api_error(response: httpx.Response) -> str:
+        """Build an error message from a non-200 Azure OpenAI response"""
+        error_msg = f"Azure OpenAI API error: {response.status_code}"
+        try:
+            error_data = orjson.loads(response.content)
+            error_detail = error_data.get("error", {})
+            error_msg += f" - {error_detail.get('message', 'Unknown error')}"
+            if "code" in error_detail:
+                error_msg += f" (Code: {error_detail['code']})"
+        except (ValueError, AttributeError, orjson.JSONDecodeError):
+            # Not a JSON error object; only decode the bytes we show
+            error_msg += f" - {response.content[:200].decode('utf-8', 'replace')}"
+        return error_msg
+    
     async def ask_question(
         self, 
         transcript: str, 
@@ -39,120 +154,121 @@ class AzureOpenAIService:
             tuple: (success: bool, answer: Optional[str], error: Optional[str])
         """
         try:
-            # Build the user content with optional conversation history
-            # Don't label it as "transcript" - make it feel like video content
-            user_content = f"Video Content:\n\n{transcript}\n\n"
-            
-            if conversation_history:
-                user_content += conversation_history + "\n\n"
-            
-            user_content += f"Question: {question}"
-            
-            # Construct the system and user messages for RAG
-            system_message = (
-                "You are an expert Q&A assistant for video content. "
-                "You analyze video content and provide helpful, accurate, and engaging answers. "
-                "Always be conversational, natural, and helpful. "
-                "IMPORTANT: Never mention 'transcript', 'transcription', 'captions', or any technical details about how you access the content. "
-                "Act as if you are directly watching and analyzing the video. "
-                "Use phrases like 'in this video', 'the speaker mentions', 'the video discusses', 'as shown in the video', etc. "
-            )
+            payload = self._build_payload(transcript, question, conversation_history)
             
-            if conversation_history:
-                system_message += (
-                    "You have access to previous questions and answers in this conversation. "
-                    "Use this context to provide better answers, especially for follow-up questions. "
-                    "If the current question refers to something from the previous conversation, "
-                    "you can reference it naturally. "
-                )
+            logger.info(f"Calling Azure OpenAI API: {self.api_url}")
             
-            system_message += (
-                "When answering questions:\n"
-                "- Base your answers on what is discussed in the video\n"
-                "- If specific details aren't mentioned, provide a helpful response based on what IS discussed\n"
-                "- Never say phrases like 'not provided', 'not mentioned', 'details are not provided', 'not in the transcript', or 'the transcript doesn't mention'\n"
-                "- Instead, offer related information from the video or explain what the video does cover on that topic\n"
-                "- Be conversational and helpful - focus on what the video DOES discuss rather than what it doesn't\n"
-                "- If asked about something completely unrelated to the video content, politely redirect to what the video is actually about\n"
-                "- Always speak as if you watched the video yourself - use natural language like 'In this video, the speaker explains...' or 'The video covers...'"
+            # Make the API call on the shared client
+            response = await self._client.post(
+                self._full_url,
+                content=orjson.dumps(payload)
             )
             
-            messages = [
-                {
-                    "role": "system",
-                    "content": system_message
-                },
-                {
-                    "role": "user",
-                    "content": user_content
-                }
-            ]
+            # Handle response
+            if response.status_code == 200:
+                data = orjson.loads(response.content)
+                choices = data.get("choices", [])
+                
+                if not choices:
+                    return False, None, "No choices returned from Azure OpenAI"
+                
+                answer = choices[0].get("message", {}).get("content", "")
+                
+                if not answer:
+                    return False, None, "No response content from Azure OpenAI"
+                
+                logger.info("Successfully received response from Azure OpenAI")
+                return True, answer, None
             
-            # Prepare the request payload
-            payload = {
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 1000,
-                "top_p": 0.95,
-                "frequency_penalty": 0,
-                "presence_penalty": 0
-            }
+            else:
+                error_msg = self._format_api_error(response)
+                logger.error(f"Azure OpenAI API error: {error_msg}")
+                return False, None, error_msg
+                
+        except httpx.TimeoutException:
+            error_msg = "Request timeout: Azure OpenAI API took too long to respond"
+            logger.error(error_msg)
+            return False, None, error_msg
+        except httpx.RequestError as e:
+            error_msg = f"Network error: {str(e)}"
+            logger.error(error_msg)
+            return False, None, error_msg
+        except Exception as e:
+            error_msg = f"Unexpected error: {str(e)}"
+            logger.error(error_msg, exc_info=True)
+            return False, None, error_msg
+    
+    async def ask_question_stream(
+        self,
+        transcript: str,
+        question: str,
+        conversation_history: Optional[str] = None
+    ) -> AsyncIterator[tuple[Optional[str], Optional[str]]]:
+        """
+        Ask a question and stream the answer as Azure OpenAI generates it
+        
+        Args:
+            transcript: The full video transcript text
+            question: The user's question
+            conversation_history: Optional formatted conversation history
+        
+        Yields:
+            tuple: (delta: Optional[str], error: Optional[str]) - text chunks of the
+            answer, or a single error entry after which the stream ends
+        """
+        try:
+            payload = self._build_payload(transcript, question, conversation_history)
+            payload["stream"] = True
             
-            logger.info(f"Calling Azure OpenAI API: {self.api_url}")
+            logger.info(f"Calling Azure OpenAI API (streaming): {self.api_url}")
             
-            # Make the API call with extended timeout for long transcripts
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                response = await client.post(
-                    f"{self.api_url}?api-version={self.api_version}",
-                    headers={
-                        "Content-Type": "application/json",
-                        "api-key": self.api_key
-                    },
-                    json=payload
-                )
+            async with self._client.stream(
+                "POST",
+                self._full_url,
+                content=orjson.dumps(payload)
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    error_msg = self._format_api_error(response)
+                    logger.error(f"Azure OpenAI API error: {error_msg}")
+                    yield None, error_msg
+                    return
                 
-                # Handle response
-                if response.status_code == 200:
-                    data = response.json()
-                    choices = data.get("choices", [])
+                # Server-sent events: "data: {json}" lines, terminated by "data: [DONE]"
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
                     
+                    choices = orjson.loads(data).get("choices")
                     if not choices:
-                        return False, None, "No choices returned from Azure OpenAI"
-                    
-                    answer = choices[0].get("message", {}).get("content", "")
+                        # e.g. the initial content-filter results chunk
+                        continue
                     
-                    if not answer:
-                        return False, None, "No response content from Azure OpenAI"
-                    
-                    logger.info("Successfully received response from Azure OpenAI")
-                    return True, answer, None
+                    delta = choices[0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta, None
+            
+            logger.info("Successfully streamed response from Azure OpenAI")
                 
-                else:
-                    error_msg = f"Azure OpenAI API error: {response.status_code}"
-                    try:
-                        error_data = response.json()
-                        error_detail = error_data.get("error", {})
-                        error_msg += f" - {error_detail.get('message', 'Unknown error')}"
-                        if "code" in error_detail:
-                            error_msg += f" (Code: {error_detail['code']})"
-                    except:
-                        error_msg += f" - {response.text[:200]}"
-                    
-                    logger.error(f"Azure OpenAI API error: {error_msg}")
-                    return False, None, error_msg
-                    
         except httpx.TimeoutException:
             error_msg = "Request timeout: Azure OpenAI API took too long to respond"
             logger.error(error_msg)
-            return False, None, error_msg
+            yield None, error_msg
         except httpx.RequestError as e:
             error_msg = f"Network error: {str(e)}"
             logger.error(error_msg)
-            return False, None, error_msg
+            yield None, error_msg
         except Exception as e:
             error_msg = f"Unexpected error: {str(e)}"
             logger.error(error_msg, exc_info=True)
-            return False, None, error_msg
+            yield None, error_msg
+    
+    async def aclose(self):
+        """Close the underlying HTTP client and its connection pool"""
+        await self._client.aclose()
 
 # Global service instance (will be initialized on first import)
 azure_openai_service = None
@@ -162,4 +278,11 @@ def get_azure_service() -> AzureOpenAIService:
     global azure_openai_service
     if azure_openai_service is None:
         azure_openai_service = AzureOpenAIService()
-    return azure_openai_service
\ No newline at end of file
+    return azure_openai_service
+
+async def close_azure_service():
+    """Close the Azure OpenAI service instance so the next lifespan builds a fresh one"""
+    global azure_openai_service
+    if azure_openai_service is not None:
+        await azure_openai_service.aclose()
+        azure_openai_service = None
\ No newline at end of file
@@ -1,25 +1,46 @@
-from typing import Optional, List, Dict
-from datetime import datetime, timedelta
+from typing import NamedTuple, Optional, List, Dict, Sequence, Tuple
+import heapq
 import logging
-from collections import defaultdict
+import time
+import orjson
+from collections import OrderedDict, deque
+from itertools import islice
+import redis.asyncio as aioredis
+from config import settings
 
 logger = logging.getLogger(__name__)
 
+class Exchange(NamedTuple):
+    """A single stored Q&A exchange"""
+    question: str
+    answer: str
+    timestamp: float  # Epoch seconds; formatted only when displayed
+
 class ConversationMemory:
     """Manages conversation history for Q&A sessions"""
     
-    def __init__(self, max_history: int = 10, ttl_hours: int = 24):
+    def __init__(self, max_history: int = 10, ttl_hours: int = 24, max_sessions: int = 10000):
         """
         Initialize conversation memory
         
         Args:
             max_history: Maximum number of Q&A pairs to keep in memory
             ttl_hours: Time to live for conversations in hours
+            max_sessions: Maximum number of sessions to keep (least recently used are evicted)
         """
-        self.conversations: Dict[str, List[Dict]] = defaultdict(list)
-        self.timestamps: Dict[str, datetime] = {}
+        # Each entry holds the exchanges plus the cached prompt string built from them
+        self.conversations: "OrderedDict[str, Dict]" = OrderedDict()
+        # Expiry deadlines (monotonic ns) per session, plus a min-heap of
+        # (deadline, key); heap entries that no longer match _deadlines are stale
+        self._deadlines: Dict[str, int] = {}
+        self._exp_heap: List[Tuple[int, str]] = []
+        self._ttl_ns = ttl_hours * 3600 * 10**9
+        # Expired sessions are swept lazily, at most once per interval
+        self._sweep_interval_ns = 60 * 10**9
+        self._last_sweep_ns = time.monotonic_ns()
         self.max_history = max_history
         self.ttl_hours = ttl_hours
+        self.max_sessions = max_sessions
     
     def _get_session_key(self, video_id: str, session_id: Optional[str] = None) -> str:
         """Generate a unique session key"""
@@ -27,25 +48,56 @@ class ConversationMemory:
             return f"{video_id}:{session_id}"
         return f"{video_id}:default"
     
-    def _cleanup_expired(self):
-        """Remove expired conversations"""
-        now = datetime.now()
-        expired_keys = [
-            key for key, timestamp in self.timestamps.items()
-            if now - timestamp > timedelta(hours=self.ttl_hours)
-        ]
-        for key in expired_keys:
-            del self.conversations[key]
-            del self.timestamps[key]
+    def _cleanup_expired(self, now: int):
+        """Remove expired conversations (at most once per sweep interval)
+        
+        Args:
+            now: Current time.monotonic_ns() value, read once by the caller
+        """
+        if now - self._last_sweep_ns < self._sweep_interval_ns:
+            return
+        self._last_sweep_ns = now
+        
+        heap = self._exp_heap
+        # Nothing can have expired if the earliest deadline is still ahead
+        if not heap or heap[0][0] > now:
+            return
+        
+        while heap and heap[0][0] <= now:
+            deadline, key = heapq.heappop(heap)
+            if self._deadlines.get(key) != deadline:
+                # Stale entry: session was refreshed, cleared or evicted
+                continue
+            del self._deadlines[key]
+            self.conversations.pop(key, None)
             logger.info(f"Cleaned up expired conversation: {key}")
     
-    def add_exchange(
+    def _touch(self, session_key: str, now_ns: int):
+        """Reset the expiry deadline for a session"""
+        deadline = now_ns + self._ttl_ns
+        self._deadlines[session_key] = deadline
+        heapq.heappush(self._exp_heap, (deadline, session_key))
+        
+        # Drop stale heap entries once they outnumber the live ones
+        if len(self._exp_heap) > 2 * len(self._deadlines) + 64:
+            self._exp_heap = [(d, k) for k, d in self._deadlines.items()]
+            heapq.heapify(self._exp_heap)
+    
+    def _evict_lru(self, count: int):
+        """Evict the least recently used sessions"""
+        for _ in range(count):
+            evicted_key, _ = self.conversations.popitem(last=False)
+            # Any heap entry for this key becomes stale and is skipped on cleanup
+            self._deadlines.pop(evicted_key, None)
+            logger.info(f"Evicted least recently used conversation: {evicted_key}")
+    
+    async def add_exchange(
         self, 
         video_id: str, 
         question: str, 
         answer: str, 
         session_id: Optional[str] = None
-    ):
+    ) -> int:
         """
         Add a Q&A exchange to conversation history
         
@@ -54,33 +106,42 @@ class ConversationMemory:
             question: User's question
             answer: AI's answer
             session_id: Optional session ID for multi-user support
+        
+        Returns:
+            Number of exchanges stored for the session after adding this one
         """
-        self._cleanup_expired()
+        now_ns = time.monotonic_ns()
+        self._cleanup_expired(now_ns)
         
         session_key = self._get_session_key(video_id, session_id)
+        entry = self.conversations.get(session_key)
+        if entry is None:
+            # Only a new session can push the store past max_sessions
+            if len(self.conversations) >= self.max_sessions:
+                self._evict_lru(len(self.conversations) - self.max_sessions + 1)
+            entry = self.conversations[session_key] = {
+                "exchanges": deque(maxlen=self.max_history),
+                "formatted": None
+            }
+        else:
+            self.conversations.move_to_end(session_key)
         
-        # Add the exchange
-        self.conversations[session_key].append({
-            "question": question,
-            "answer": answer,
-            "timestamp": datetime.now().isoformat()
-        })
+        # Add the exchange (the deque drops the oldest one past max_history)
+        entry["exchanges"].append(Exchange(question, answer, time.time()))
+        entry["formatted"] = None
         
-        # Limit history size
-        if len(self.conversations[session_key]) > self.max_history:
-            self.conversations[session_key] = self.conversations[session_key][-self.max_history:]
+        # Update expiry deadline
+        self._touch(session_key, now_ns)
         
-        # Update timestamp
-        self.timestamps[session_key] = datetime.now()
-        
-        logger.info(f"Added exchange to conversation {session_key} (total: {len(self.conversations[session_key])})")
+        logger.info(f"Added exchange to conversation {session_key} (total: {len(entry['exchanges'])})")
+        return len(entry["exchanges"])
     
-    def get_history(
+    async def get_history(
         self, 
         video_id: str, 
         session_id: Optional[str] = None,
         limit: Optional[int] = None
-    ) -> List[Dict]:
+    ) -> Tuple[Exchange, ...]:
         """
         Get conversation history for a session
         
@@ -90,32 +151,64 @@ class ConversationMemory:
             limit: Optional limit on number of exchanges to return
         
         Returns:
-            List of Q&A exchanges
+            Tuple of Q&A exchanges (oldest first)
         """
-        self._cleanup_expired()
+        self._cleanup_expired(time.monotonic_ns())
         
         session_key = self._get_session_key(video_id, session_id)
-        history = self.conversations.get(session_key, [])
+        entry = self.conversations.get(session_key)
+        if entry is None:
+            return ()
+        
+        self.conversations.move_to_end(session_key)
+        history = entry["exchanges"]
         
         if limit:
-            return history[-limit:]
-        return history
+            return tuple(islice(history, max(0, len(history) - limit), len(history)))
+        return tuple(history)
     
-    def clear_history(self, video_id: str, session_id: Optional[str] = None):
+    async def clear_history(self, video_id: str, session_id: Optional[str] = None):
         """Clear conversation history for a session"""
         session_key = self._get_session_key(video_id, session_id)
         if session_key in self.conversations:
             del self.conversations[session_key]
-        if session_key in self.timestamps:
-            del self.timestamps[session_key]
+        # Any heap entry for this key becomes stale and is skipped on cleanup
+        self._deadlines.pop(session_key, None)
         logger.info(f"Cleared conversation history for {session_key}")
     
-    def format_history_for_prompt(self, history: List[Dict]) -> str:
+    async def get_formatted_history(self, video_id: str, session_id: Optional[str] = None) -> str:
+        """
+        Get conversation history for a session formatted for the prompt
+        
+        The formatted string is cached per session and rebuilt only after
+        a new exchange is added.
+        
+        Args:
+            video_id: YouTube video ID
+            session_id: Optional session ID
+        
+        Returns:
+            Formatted string of conversation history (empty if there is none)
+        """
+        self._cleanup_expired(time.monotonic_ns())
+        
+        session_key = self._get_session_key(video_id, session_id)
+        entry = self.conversations.get(session_key)
+        if entry is None:
+            return ""
+        
+        self.conversations.move_to_end(session_key)
+        if entry["formatted"] is None:
+            entry["formatted"] = self.format_history_for_prompt(entry["exchanges"])
+        return entry["formatted"]
+    
+    @staticmethod
+    def format_history_for_prompt(history: Sequence[Exchange]) -> str:
         """
         Format conversation history for inclusion in prompt
         
         Args:
-            history: List of Q&A exchanges
+            history: Sequence of Q&A exchanges
         
         Returns:
             Formatted string of conversation history
@@ -123,13 +216,100 @@ class ConversationMemory:
         if not history:
             return ""
         
-        formatted = "\n\nPrevious conversation:\n"
+        # Pre-sized parts list joined once, instead of growing a string per exchange
+        parts = [None] * (len(history) + 1)
+        parts[0] = "\n\nPrevious conversation:\n"
         for i, exchange in enumerate(history, 1):
-            formatted += f"\nQ{i}: {exchange['question']}\n"
-            formatted += f"A{i}: {exchange['answer']}\n"
+            parts[i] = f"\nQ{i}: {exchange.question}\nA{i}: {exchange.answer}\n"
         
-        return formatted
+        return "".join(parts)
+    
+    async def aclose(self):
+        """Release resources (nothing to do for the in-process store)"""
+
+class RedisConversationMemory:
+    """Conversation history stored in Redis, shared by all workers
+    
+    Each session is a Redis list of orjson-encoded exchanges; Redis enforces
+    the TTL per key, so no in-process expiry bookkeeping is needed.
+    """
+    
+    def __init__(
+        self,
+        redis_url: str,
+        max_history: int = 10,
+        ttl_hours: int = 24,
+        key_prefix: str = "ytqa:conversation:"
+    ):
+        """
+        Initialize Redis-backed conversation memory
+        
+        Args:
+            redis_url: Redis connection URL (e.g. redis://localhost:6379/0)
+            max_history: Maximum number of Q&A pairs to keep per session
+            ttl_hours: Time to live for conversations in hours
+            key_prefix: Prefix for the Redis keys holding conversations
+        """
+        self._redis = aioredis.Redis.from_url(redis_url)
+        self._ttl_seconds = ttl_hours * 3600
+        self._key_prefix = key_prefix
+        self.max_history = max_history
+        self.ttl_hours = ttl_hours
+    
+    def _get_session_key(self, video_id: str, session_id: Optional[str] = None) -> str:
+        """Generate a unique Redis key for a session"""
+        return f"{self._key_prefix}{video_id}:{session_id or 'default'}"
+    
+    async def add_exchange(
+        self,
+        video_id: str,
+        question: str,
+        answer: str,
+        session_id: Optional[str] = None
+    ) -> int:
+        """Add a Q&A exchange, trim to max_history and refresh the TTL"""
+        session_key = self._get_session_key(video_id, session_id)
+        exchange = Exchange(question, answer, time.time())
+        
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(session_key, orjson.dumps(exchange._asdict()))
+            pipe.ltrim(session_key, -self.max_history, -1)
+            pipe.expire(session_key, self._ttl_seconds)
+            length, _, _ = await pipe.execute()
+        
+        length = min(length, self.max_history)
+        logger.info(f"Added exchange to conversation {session_key} (total: {length})")
+        return length
+    
+    async def get_history(
+        self,
+        video_id: str,
+        session_id: Optional[str] = None,
+        limit: Optional[int] = None
+    ) -> Tuple[Exchange, ...]:
+        """Get conversation history for a session (oldest first)"""
+        session_key = self._get_session_key(video_id, session_id)
+        items = await self._redis.lrange(session_key, -limit if limit else 0, -1)
+        return tuple(Exchange(**orjson.loads(item)) for item in items)
+    
+    async def clear_history(self, video_id: str, session_id: Optional[str] = None):
+        """Clear conversation history for a session"""
+        session_key = self._get_session_key(video_id, session_id)
+        await self._redis.delete(session_key)
+        logger.info(f"Cleared conversation history for {session_key}")
+    
+    async def get_formatted_history(self, video_id: str, session_id: Optional[str] = None) -> str:
+        """Get conversation history for a session formatted for the prompt"""
+        history = await self.get_history(video_id, session_id)
+        return ConversationMemory.format_history_for_prompt(history)
+    
+    async def aclose(self):
+        """Close the Redis connection pool"""
+        await self._redis.aclose()
 
-# Global conversation memory instance
-conversation_memory = ConversationMemory(max_history=10, ttl_hours=24)
+# Global conversation memory instance (shared across workers when Redis is configured)
+if settings.REDIS_URL:
+    conversation_memory = RedisConversationMemory(settings.REDIS_URL, max_history=10, ttl_hours=24)
+else:
+    conversation_memory = ConversationMemory(max_history=10, ttl_hours=24, max_sessions=10000)
 
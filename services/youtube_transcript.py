@@ -2,19 +2,96 @@ import httpx
 from typing import Optional
 import logging
 import asyncio
-from config import settings  # Fixed import
 import re
 import html
+import time
+from collections import OrderedDict
+from io import BytesIO
+from lxml import etree
 
 logger = logging.getLogger(__name__)
+
+# Transcript parsing patterns, compiled once at import
+_TEXT_RE = re.compile(r'<text[^>]*>(.*?)</text>', re.DOTALL)
+_P_RE = re.compile(r'<p[^>]*>(.*?)</p>', re.DOTALL)
+_TAG_RE = re.compile(r'<[^>]+>')
+_VTT_SKIP_RE = re.compile(r'WEBVTT|NOTE|STYLE|\d+$|.*-->')
+
+# Shared client so transcript fetches reuse pooled (HTTP/2) connections to YouTube
+_client: Optional[httpx.AsyncClient] = None
+
+def get_client() -> httpx.AsyncClient:
+    """Get or create the shared YouTube HTTP client"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=30.0,
+            follow_redirects=True,
+            limits=httpx.Limits(max_keepalive_connections=32),
+            http2=True
+        )
+    return _client
+
+async def close_client():
+    """Close the shared YouTube HTTP client"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+# Caption format requested from the timedtext endpoint (srv3 is most common)
+_TRANSCRIPT_FORMAT = "srv3"
+
+# Maximum number of concurrent timedtext requests per transcript fetch
+_MAX_CONCURRENT_FETCHES = 4
+
+# Transcripts are effectively immutable, so successful fetches are cached per video
+_TRANSCRIPT_CACHE_MAX_SIZE = 1024
+_TRANSCRIPT_CACHE_TTL_SECONDS = 3600
+_transcript_cache: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+# In-flight fetches, so concurrent cold misses for one video share a single request
+_transcript_inflight: dict[str, "asyncio.Task[tuple[bool, Optional[str], Optional[str]]]"] = {}
+
 class YouTubeTranscriptService:
     """Service for fetching YouTube video transcripts using YouTube transcript API"""
     
+    @staticmethod
+    async def get_cached_transcript(video_id: str) -> tuple[bool, Optional[str], Optional[str]]:
+        """
+        Fetch transcript with an in-process LRU/TTL cache in front of get_transcript
+        Only successful fetches are cached; failures are retried on the next call
+        """
+        now = time.monotonic()
+        cached = _transcript_cache.get(video_id)
+        if cached is not None:
+            expires_at, transcript = cached
+            if expires_at > now:
+                _transcript_cache.move_to_end(video_id)
+                logger.info(f"Transcript cache hit for video: {video_id}")
+                return True, transcript, None
+            del _transcript_cache[video_id]
+        
+        task = _transcript_inflight.get(video_id)
+        if task is None:
+            task = asyncio.create_task(YouTubeTranscriptService.get_transcript(video_id))
+            _transcript_inflight[video_id] = task
+            task.add_done_callback(lambda _: _transcript_inflight.pop(video_id, None))
+        
+        # Shield so one cancelled caller doesn't cancel the fetch for the others
+        success, transcript, error = await asyncio.shield(task)
+        
+        if success and video_id not in _transcript_cache:
+            _transcript_cache[video_id] = (time.monotonic() + _TRANSCRIPT_CACHE_TTL_SECONDS, transcript)
+            if len(_transcript_cache) > _TRANSCRIPT_CACHE_MAX_SIZE:
+                _transcript_cache.popitem(last=False)
+        
+        return success, transcript, error
+    
     @staticmethod
     async def get_transcript(video_id: str, languages: list[str] = None) -> tuple[bool, Optional[str], Optional[str]]:
         """
         Fetch transcript using YouTube's transcript API endpoint
-        Try just one format/language first to avoid rate limiting
+        Languages are requested concurrently (srv3 only, to avoid rate limiting)
         """
         if languages is None:
             languages = ['en', 'en-US', 'en-GB']
@@ -22,58 +99,56 @@ class YouTubeTranscriptService:
         try:
             logger.info(f"Fetching transcript for video: {video_id}")
             
-            async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
-                # Try just ONE format first (srv3 is most common)
-                url = f"https://www.youtube.com/api/timedtext"
-                
-                # Try languages in order, one at a time
-                for lang in languages:
-                    try:
-                        params = {
-                            "v": video_id,
-                            "lang": lang,
-                            "fmt": "srv3"
-                        }
-                        
-                        response = await client.get(url, params=params)
-                        
-                        # If rate limited, stop immediately
-                        if response.status_code == 429:
-                            logger.warning(f"Rate limited by YouTube. Azure IP is blocked.")
-                            return False, None, "YouTube is rate limiting requests from this server. This is common with cloud provider IPs. Please wait a few minutes or use a different server."
-                        
-                        logger.info(f"Response status ({lang}): {response.status_code}, length: {len(response.text) if response.text else 0}")
-                        
-                        if response.status_code == 200 and response.text and len(response.text.strip()) > 0:
-                            logger.info(f"Response preview: {response.text[:300]}")
-                            
-                            transcript_text = YouTubeTranscriptService._parse_transcript_xml(response.text)
-                            
-                            if transcript_text and transcript_text.strip():
-                                logger.info(f"Found transcript in language: {lang}")
-                                return True, transcript_text, None
-                    except Exception as e:
-                        logger.debug(f"Failed ({lang}): {str(e)}")
-                        continue
-                
-                # If no language worked, try without language (auto-detect) - ONE attempt only
-                try:
-                    params = {"v": video_id, "fmt": "srv3"}
-                    response = await client.get(url, params=params)
+            client = get_client()
+            
+            # Try just ONE format first (srv3 is most common)
+            url = f"https://www.youtube.com/api/timedtext"
+            
+            # Request all languages concurrently (bounded to stay under YouTube's
+            # rate limits), but check results in preference order
+            semaphore = asyncio.Semaphore(_MAX_CONCURRENT_FETCHES)
+            tasks = [
+                asyncio.create_task(
+                    YouTubeTranscriptService._fetch_language(client, semaphore, url, video_id, lang)
+                )
+                for lang in languages
+            ]
+            try:
+                for task in tasks:
+                    lang, status_code, transcript_text = await task
                     
-                    if response.status_code == 429:
-                        return False, None, "YouTube is rate limiting requests from this server. This is common with cloud provider IPs."
+                    # If rate limited, stop immediately
+                    if status_code == 429:
+                        logger.warning(f"Rate limited by YouTube. Azure IP is blocked.")
+                        return False, None, "YouTube is rate limiting requests from this server. This is common with cloud provider IPs. Please wait a few minutes or use a different server."
                     
-                    if response.status_code == 200 and response.text:
-                        transcript_text = YouTubeTranscriptService._parse_transcript_xml(response.text)
-                        if transcript_text and transcript_text.strip():
-                            logger.info("Found transcript (auto-detected)")
-                            return True, transcript_text, None
-                except Exception as e:
-                    logger.debug(f"Auto-detect failed: {str(e)}")
+                    if transcript_text:
+                        logger.info(f"Found transcript in language: {lang}")
+                        return True, transcript_text, None
+            finally:
+                # Cancel the remaining requests and let them unwind
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            
+            # If no language worked, try without language (auto-detect) - ONE attempt only
+            try:
+                params = {"v": video_id, "fmt": _TRANSCRIPT_FORMAT}
+                response = await client.get(url, params=params)
                 
-                return False, None, "No captions available for this video or YouTube is blocking requests."
+                if response.status_code == 429:
+                    return False, None, "YouTube is rate limiting requests from this server. This is common with cloud provider IPs."
                 
+                if response.status_code == 200 and response.text:
+                    transcript_text = YouTubeTranscriptService._parse_transcript(response.text, _TRANSCRIPT_FORMAT)
+                    if transcript_text and transcript_text.strip():
+                        logger.info("Found transcript (auto-detected)")
+                        return True, transcript_text, None
+            except Exception as e:
+                logger.debug(f"Auto-detect failed: {str(e)}")
+            
+            return False, None, "No captions available for this video or YouTube is blocking requests."
+            
         except httpx.TimeoutException:
             return False, None, "Request timeout while fetching transcript"
         except Exception as e:
@@ -82,55 +157,132 @@ class YouTubeTranscriptService:
             return False, None, error_msg
     
     @staticmethod
-    def _parse_transcript_xml(xml_content: str) -> str:
-        """Parse YouTube transcript XML format and extract text"""
-        # Try multiple patterns for different XML structures
-        text_lines = []
-        
-        # Pattern 1: <text start="..." dur="...">text content</text>
-        pattern1 = r'<text[^>]*>(.*?)</text>'
-        matches1 = re.findall(pattern1, xml_content, re.DOTALL)
-        if matches1:
-            text_lines.extend([html.unescape(match.strip()) for match in matches1 if match.strip()])
-        
-        # Pattern 2: <p t="..." d="...">text content</p>
-        pattern2 = r'<p[^>]*>(.*?)</p>'
-        matches2 = re.findall(pattern2, xml_content, re.DOTALL)
-        if matches2:
-            text_lines.extend([html.unescape(match.strip()) for match in matches2 if match.strip()])
+    async def _fetch_language(
+        client: httpx.AsyncClient,
+        semaphore: asyncio.Semaphore,
+        url: str,
+        video_id: str,
+        lang: str
+    ) -> tuple[str, Optional[int], Optional[str]]:
+        """
+        Fetch and parse the srv3 transcript for a single language
         
-        # Pattern 3: Just extract all text between tags
-        if not text_lines:
-            # Remove all XML tags and get remaining text
-            text = re.sub(r'<[^>]+>', ' ', xml_content)
-            text = html.unescape(text)
-            text_lines = [line.strip() for line in text.split() if line.strip()]
+        Returns:
+            tuple: (lang, status_code: Optional[int], transcript_text: Optional[str])
+        """
+        try:
+            params = {
+                "v": video_id,
+                "lang": lang,
+                "fmt": _TRANSCRIPT_FORMAT
+            }
+            
+            async with semaphore:
+                response = await client.get(url, params=params)
+            
+            if response.status_code == 429:
+                return lang, response.status_code, None
+            
+            logger.info(f"Response status ({lang}): {response.status_code}, length: {len(response.text) if response.text else 0}")
+            
+            if response.status_code == 200 and response.text and len(response.text.strip()) > 0:
+                logger.info(f"Response preview: {response.text[:300]}")
+                
+                transcript_text = YouTubeTranscriptService._parse_transcript(response.text, _TRANSCRIPT_FORMAT)
+                
+                if transcript_text and transcript_text.strip():
+                    return lang, response.status_code, transcript_text
+            
+            return lang, response.status_code, None
+        except Exception as e:
+            logger.debug(f"Failed ({lang}): {str(e)}")
+            return lang, None, None
+    
+    @staticmethod
+    def _parse_transcript(content: str, fmt: str) -> str:
+        """Parse a transcript body with the parser for its caption format"""
+        parser = _PARSERS.get(fmt, YouTubeTranscriptService._parse_transcript_xml)
+        return parser(content)
+    
+    @staticmethod
+    def _parse_transcript_xml(
+        xml_content: str,
+        tags: tuple[str, ...] = ("{*}text", "{*}p"),
+        patterns: tuple[re.Pattern, ...] = (_TEXT_RE, _P_RE)
+    ) -> str:
+        """Parse YouTube transcript XML format and extract text"""
+        # Stream caption elements with lxml's C parser instead of regex-scanning the document
+        try:
+            text_lines = []
+            for _, element in etree.iterparse(
+                BytesIO(xml_content.encode('utf-8')),
+                events=("end",),
+                tag=tags,
+                resolve_entities=False
+            ):
+                # srv3 nests words in <s> children, so collect all descendant text
+                text = "".join(element.itertext()).strip()
+                if text:
+                    text_lines.append(text)
+                element.clear()
+            
+            if text_lines:
+                # lxml has already decoded the XML layer of entities; YouTube
+                # HTML-escapes cue text before XML-escaping it (e.g. "&amp;#39;"),
+                # so one more pass decodes the HTML layer
+                return html.unescape(' '.join(text_lines))
+        except etree.XMLSyntaxError as e:
+            logger.debug(f"Transcript XML is not well-formed, using regex parser: {str(e)}")
         
-        return ' '.join(text_lines)
+        return YouTubeTranscriptService._parse_transcript_xml_regex(xml_content, patterns)
     
     @staticmethod
-    def _parse_vtt(vtt_content: str) -> str:
-        """Parse WebVTT format"""
-        lines = vtt_content.split('\n')
+    def _parse_transcript_xml_regex(
+        xml_content: str,
+        patterns: tuple[re.Pattern, ...] = (_TEXT_RE, _P_RE)
+    ) -> str:
+        """Regex fallback for transcript XML that lxml cannot parse"""
+        # Try each caption pattern (<text ...>...</text>, <p ...>...</p>)
         text_lines = []
+        for pattern in patterns:
+            text_lines.extend([match.strip() for match in pattern.findall(xml_content) if match.strip()])
         
-        for line in lines:
-            line = line.strip()
-            # Skip VTT headers, timestamps, and empty lines
-            if not line or line.startswith('WEBVTT') or '-->' in line or line.isdigit():
-                continue
-            # Skip style/note blocks
-            if line.startswith('NOTE') or line.startswith('STYLE'):
-                continue
-            text_lines.append(line)
+        # Raw cue text carries both entity layers (XML, then YouTube's HTML
+        # escaping), so decode twice to match the lxml path
+        if text_lines:
+            return html.unescape(html.unescape(' '.join(text_lines)))
         
-        return ' '.join(text_lines)
+        # Last resort: just extract all text between tags
+        # Remove all XML tags and get remaining text
+        text = _TAG_RE.sub(' ', xml_content)
+        text = html.unescape(html.unescape(text))
+        return ' '.join(text.split())
+    
+    @staticmethod
+    def _parse_text_tags(xml_content: str) -> str:
+        """Parse srv1/srv2 format (<text> cues)"""
+        return YouTubeTranscriptService._parse_transcript_xml(xml_content, ("{*}text",), (_TEXT_RE,))
+    
+    @staticmethod
+    def _parse_p_tags(xml_content: str) -> str:
+        """Parse srv3 and TTML formats (<p> cues)"""
+        return YouTubeTranscriptService._parse_transcript_xml(xml_content, ("{*}p",), (_P_RE,))
     
     @staticmethod
-    def _parse_ttml(ttml_content: str) -> str:
-        """Parse TTML format"""
-        # Extract text from <p> tags in TTML
-        pattern = r'<p[^>]*>(.*?)</p>'
-        matches = re.findall(pattern, ttml_content, re.DOTALL)
-        text_lines = [html.unescape(match.strip()) for match in matches if match.strip()]
-        return ' '.join(text_lines)
\ No newline at end of file
+    def _parse_vtt(vtt_content: str) -> str:
+        """Parse WebVTT format"""
+        # Skip empty lines, VTT headers, cue numbers, timestamps and style/note blocks
+        text_lines = [
+            line for line in map(str.strip, vtt_content.split('\n'))
+            if line and not _VTT_SKIP_RE.match(line)
+        ]
+        return ' '.join(text_lines)
+
+# Caption format -> parser; unknown formats use the generic XML parser
+_PARSERS = {
+    "srv1": YouTubeTranscriptService._parse_text_tags,
+    "srv2": YouTubeTranscriptService._parse_text_tags,
+    "srv3": YouTubeTranscriptService._parse_p_tags,
+    "ttml": YouTubeTranscriptService._parse_p_tags,
+    "vtt": YouTubeTranscriptService._parse_vtt
+}
\ No newline at end of file